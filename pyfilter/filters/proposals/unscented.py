@@ -33,7 +33,7 @@ class Unscented(Proposal):
             return self
 
         self._ut_res.mean = choose(self._ut_res.mean, inds)
-        self._ut_res.cov = choose(self._ut_res.cov, inds)
+        self._ut_res.cholcov = choose(self._ut_res.cholcov, inds)
 
         return self
 
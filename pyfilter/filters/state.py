@@ -29,10 +29,10 @@ class KalmanState(BaseState):
 
     def resample(self, inds):
         self.utf.mean = choose(self.utf.mean, inds)
-        self.utf.cov = choose(self.utf.cov, inds)
+        self.utf.cholcov = choose(self.utf.cholcov, inds)
 
         self.utf.ym = choose(self.utf.ym, inds)
-        self.utf.yc = choose(self.utf.yc, inds)
+        self.utf.yl = choose(self.utf.yl, inds)
 
         self.ll = choose(self.ll, inds)
 
@@ -41,10 +41,10 @@ class KalmanState(BaseState):
 
     def exchange(self, state, inds):
         self.utf.mean[inds] = state.utf.mean[inds]
-        self.utf.cov[inds] = state.utf.cov[inds]
+        self.utf.cholcov[inds] = state.utf.cholcov[inds]
 
         self.utf.ym[inds] = state.utf.ym[inds]
-        self.utf.yc[inds] = state.utf.yc[inds]
+        self.utf.yl[inds] = state.utf.yl[inds]
 
         self.ll[inds] = state.ll[inds]
 
@@ -2,18 +2,24 @@ from abc import ABC
 from torch.nn import Module
 import torch
 from typing import Tuple
-from ..filters import BaseFilter, utils as u
+from ..filters import BaseFilter
 from ..logging import LoggingWrapper, TqdmWrapper
 from .state import AlgorithmState
+from .utils import _to_tensor
 
 
 class BaseAlgorithm(Module, ABC):
     def __init__(self):
         super().__init__()
 
-    @u.enforce_tensor
-    def fit(self, y: torch.Tensor, logging: LoggingWrapper = None, **kwargs) -> AlgorithmState:
-        return self._fit(y, logging_wrapper=logging or TqdmWrapper(), **kwargs)
+    def fit(self, y, logging: LoggingWrapper = None, **kwargs) -> AlgorithmState:
+        """
+        Fits the algorithm to the data `y`.
+        :param y: The data, i.e. a tensor, array, list or object exposing `to_numpy`, such as `pandas.DataFrame`
+        :param logging: The logging wrapper to use
+        """
+
+        return self._fit(_to_tensor(y), logging_wrapper=logging or TqdmWrapper(), **kwargs)
 
     def _fit(self, y: torch.Tensor, logging_wrapper: LoggingWrapper, **kwargs) -> AlgorithmState:
         raise NotImplementedError()
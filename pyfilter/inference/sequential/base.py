@@ -25,6 +25,10 @@ class SequentialFilteringAlgorithm(BaseFilterAlgorithm, ABC):
         logging_wrapper.set_num_iter(y.shape[0])
         try:
             state = self.initialize()
+
+            # ===== Move the data to the device of the state once, rather than per observation ===== #
+            y = y.to(state.w.device).contiguous()
+
             for i, yt in enumerate(y):
                 state = self.update(yt, state)
                 logging_wrapper.do_log(i, self, y)
@@ -76,20 +80,25 @@ class SequentialParticleAlgorithm(SequentialFilteringAlgorithm, ABC):
         return xm, ym
 
 
-class CombinedSequentialParticleAlgorithm(SequentialParticleAlgorithm, ABC):
+class CombinedSequentialParticleAlgorithm(SequentialFilteringAlgorithm, ABC):
     def __init__(self, filter_, particles, switch: int, first_kw, second_kw):
         """
-        Algorithm combining two other algorithms.
+        Algorithm combining two other algorithms. The particles are owned by the sub algorithms.
         :param switch: After how many observations to perform switch
         """
 
-        super().__init__(filter_, particles)
+        super().__init__(filter_)
+
         self._first = self.make_first(filter_, particles, **(first_kw or dict()))
         self._second = self.make_second(filter_, particles, **(second_kw or dict()))
         self._when_to_switch = switch
         self._is_switched = torch.tensor(False, dtype=torch.bool)
         self._num_iters = 0
 
+    @property
+    def particles(self) -> torch.Size:
+        return self._first.particles
+
     def make_first(self, filter_, particles, **kwargs) -> SequentialParticleAlgorithm:
         raise NotImplementedError()
 
@@ -107,12 +116,14 @@ class CombinedSequentialParticleAlgorithm(SequentialParticleAlgorithm, ABC):
     def _update(self, y: torch.Tensor, state):
         self._num_iters += 1
 
-        if not self._is_switched:
-            if self._num_iters <= self._when_to_switch:
-                return self._first.update(y, state)
+        if self._num_iters <= self._when_to_switch:
+            return self._first.update(y, state)
+
+        self._is_switched = True
+        state = self.do_on_switch(self._first, self._second, state)
 
-            self._is_switched = True
-            state = self.do_on_switch(self._first, self._second, state)
+        # ===== Once switched we never switch back, so dispatch directly to the second algorithm ===== #
+        self._update = self._second.update
 
         return self._second.update(y, state)
 
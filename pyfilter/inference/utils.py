@@ -5,6 +5,7 @@ from ..filters import BaseFilter, FilterResult
 from .state import AlgorithmState
 from torch.distributions import Distribution, Independent
 import torch
+import numpy as np
 from typing import Tuple
 
 
@@ -28,6 +29,31 @@ def _construct_mvn(x: torch.Tensor, w: torch.Tensor, scale=1.0):
     return MultivariateNormal(mean, scale_tril=scale * chol)
 
 
+def _to_tensor(data) -> torch.Tensor:
+    """
+    Converts the data to a contiguous tensor. Handles tensors, arrays, lists and objects exposing `to_numpy`, e.g.
+    `pandas.DataFrame`, without requiring pandas. Converted floating point data is cast to the default dtype.
+    """
+
+    if isinstance(data, torch.Tensor):
+        return data.contiguous()
+
+    try:
+        array = np.asarray(data.to_numpy() if hasattr(data, "to_numpy") else data)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Cannot convert observations of type '{type(data).__name__}' to a Tensor!") from e
+
+    if array.dtype.kind not in "biuf":
+        raise ValueError(f"Cannot convert observations of type '{type(data).__name__}' to a Tensor!")
+
+    data = torch.as_tensor(array)
+
+    if data.is_floating_point():
+        data = data.to(torch.get_default_dtype())
+
+    return data.contiguous()
+
+
 def experimental(func):
     def wrapper(obj, *args, **kwargs):
         warnings.warn(f"{obj:s} is an experimental algorithm, use at own risk")
@@ -1,88 +1,180 @@
 import torch
+from dataclasses import dataclass
 from math import sqrt
 from torch.distributions import Normal, MultivariateNormal
 from torch.nn import Module
-from typing import Tuple
-from .utils import construct_diag, ShapeLike, size_getter
-from .timeseries import StateSpaceModel, StochasticProcess
+from typing import Tuple, Dict, Callable, List
+from .utils import ShapeLike, size_getter
+from .timeseries import StateSpaceModel
 from .parameter import ExtendedParameter
 
 
 def _propagate_sps(
-    spx: torch.Tensor, spn: torch.Tensor, process: StochasticProcess, temp_params: Tuple[torch.Tensor, ...]
+    spx: torch.Tensor,
+    spn: torch.Tensor,
+    propagate_u: Callable[..., torch.Tensor],
+    is_md: bool,
+    temp_params: Tuple[torch.Tensor, ...],
 ):
-    is_md = process.ndim > 0
-
     if not is_md:
         spx = spx.squeeze(-1)
         spn = spn.squeeze(-1)
 
-    out = process.propagate_u(spx, u=spn, parameters=temp_params)
+    out = propagate_u(spx, u=spn, parameters=temp_params)
     return out if is_md else out.unsqueeze(-1)
 
 
+@torch.jit.script
 def _covariance(a: torch.Tensor, b: torch.Tensor, wc: torch.Tensor):
     """
-    Calculates the covariance from a * b^t
+    Calculates the covariance from a * b^t, without materializing the individual outer products
+    """
+
+    return torch.einsum("...si,...sj,s->...ij", [a, b, wc])
+
+
+@torch.jit.script
+def _check_cholesky(chol: torch.Tensor):
+    """
+    Raises if the lower triangular factor `chol` is not that of a positive definite matrix, e.g. when a downdate
+    yields an indefinite matrix, rather than silently propagating NaNs.
+    """
+
+    if not bool(((chol.diagonal(dim1=-2, dim2=-1) > 0.0).all() & torch.isfinite(chol).all())):
+        raise ValueError("The covariance is not positive definite!")
+
+    return chol
+
+
+@torch.jit.script
+def _cholupdate(chol: torch.Tensor, x: torch.Tensor, sign: torch.Tensor):
+    """
+    Performs a rank one update of the lower triangular Cholesky factor `chol`, i.e. returns the factor of
+        chol * chol^t + sign * x * x^t
+    where a negative `sign` corresponds to a downdate. Raises if the resulting matrix is not positive definite.
+    """
+
+    # ===== Build the columns out of place, as in place writes would break the backward pass ===== #
+    columns: List[torch.Tensor] = []
+
+    for k in range(chol.shape[-1]):
+        diag = chol[..., k, k]
+        xk = x[..., k]
+
+        r = (diag ** 2 + sign * xk ** 2).sqrt()
+        c = (r / diag).unsqueeze(-1)
+        s = (xk / diag).unsqueeze(-1)
+
+        lower = (chol[..., k + 1 :, k] + sign * s * x[..., k + 1 :]) / c
+        columns.append(torch.cat((torch.zeros_like(chol[..., :k, k]), r.unsqueeze(-1), lower), dim=-1))
+
+        x = torch.cat((x[..., : k + 1], c * x[..., k + 1 :] - s * lower), dim=-1)
+
+    return _check_cholesky(torch.stack(columns, dim=-1))
+
+
+@torch.jit.script
+def _sqrt_covariance(centered: torch.Tensor, wc: torch.Tensor):
+    """
+    Calculates the lower triangular square root of the covariance of the centered sigma points, i.e. the QR
+    decomposition of the sigma points with positive weights followed by a rank one update with the central one.
     """
-    cov = a.unsqueeze(-1) * b.unsqueeze(-2)
 
-    return (wc[:, None, None] * cov).sum(-3)
+    # ===== The square root of a scalar variance needs no decomposition ===== #
+    if centered.shape[-1] == 1:
+        return _check_cholesky(_covariance(centered, centered, wc).sqrt())
+
+    weighted = wc[1:].sqrt().unsqueeze(-1) * centered[..., 1:, :]
+
+    # ===== Always factorize a single batch of matrices, so as to hit the batched kernels ===== #
+    batch_shape, ndim = list(weighted.shape[:-2]), weighted.shape[-1]
+    flattened = weighted.reshape(-1, weighted.shape[-2], ndim)
+    r = torch.linalg.qr(flattened, mode="r")[1].view(batch_shape + [ndim, ndim])
 
+    diag = r.diagonal(dim1=-2, dim2=-1)
+    sign = torch.where(diag < 0.0, -torch.ones_like(diag), torch.ones_like(diag))
+    chol = (sign.unsqueeze(-1) * r).transpose(-1, -2)
 
+    return _cholupdate(chol, wc[0].abs().sqrt() * centered[..., 0, :], wc[0].sign())
+
+
+@torch.jit.script
 def _get_meancov(spxy: torch.Tensor, wm: torch.Tensor, wc: torch.Tensor):
     x = (wm.unsqueeze(-1) * spxy).sum(-2)
     centered = spxy - x.unsqueeze(-2)
 
-    return x, _covariance(centered, centered, wc)
+    return x, centered, _sqrt_covariance(centered, wc)
 
 
 class UFTCorrectionResult(Module):
-    def __init__(self, mean: torch.Tensor, cov: torch.Tensor, state_slice: slice, ym: torch.Tensor, yc: torch.Tensor):
+    def __init__(self, mean: torch.Tensor, cholcov: torch.Tensor, ym: torch.Tensor, yl: torch.Tensor):
+        """
+        The corrected state of the unscented transform. The covariances are only stored as their lower triangular
+        Cholesky factors `cholcov` and `yl`.
+        """
+
         super().__init__()
         self.register_buffer("ym", ym)
-        self.register_buffer("yc", yc)
+        self.register_buffer("yl", yl)
 
         self.register_buffer("mean", mean)
-        self.register_buffer("cov", cov)
-        self._sslc = state_slice
+        self.register_buffer("cholcov", cholcov)
 
     @property
     def xm(self):
-        return self.mean[..., self._sslc]
+        return self.mean
+
+    @property
+    def cov(self):
+        return torch.matmul(self.cholcov, self.cholcov.transpose(-1, -2))
 
     @property
     def xc(self):
-        return self.cov[..., self._sslc, self._sslc]
+        return self.cov
+
+    @property
+    def yc(self):
+        return torch.matmul(self.yl, self.yl.transpose(-1, -2))
 
     @staticmethod
-    def _helper(m, c):
+    def _helper(m, scale_tril):
         if m.shape[-1] > 1:
-            return MultivariateNormal(m, c)
+            return MultivariateNormal(m, scale_tril=scale_tril)
 
-        return Normal(m[..., 0], c[..., 0, 0].sqrt())
+        return Normal(m[..., 0], scale_tril[..., 0, 0])
 
     def x_dist(self):
-        return self._helper(self.xm, self.xc)
+        return self._helper(self.xm, self.cholcov)
 
     def y_dist(self):
-        return self._helper(self.ym, self.yc)
+        return self._helper(self.ym, self.yl)
 
 
-class UFTPredictionResult(Module):
-    def __init__(self, spx: torch.Tensor, spy: torch.Tensor):
-        super().__init__()
-        self.spx = spx
-        self.spy = spy
+@dataclass
+class UFTPredictionResult:
+    spx: torch.Tensor
+    spy: torch.Tensor
 
 
-class AggregatedResult(Module):
-    def __init__(self, xm, xc, ym, yc):
-        super().__init__()
-        self.xm = xm
-        self.xc = xc
-        self.ym = ym
-        self.yc = yc
+@dataclass
+class AggregatedResult:
+    """
+    Aggregated moments of the propagated sigma points, where the covariances are given by their lower triangular
+    Cholesky factors `xl` and `yl`.
+    """
+
+    xm: torch.Tensor
+    xl: torch.Tensor
+    ym: torch.Tensor
+    yl: torch.Tensor
+
+    @property
+    def xc(self):
+        return torch.matmul(self.xl, self.xl.transpose(-1, -2))
+
+    @property
+    def yc(self):
+        return torch.matmul(self.yl, self.yl.transpose(-1, -2))
 
 
 class UnscentedFilterTransform(Module):
@@ -110,13 +202,24 @@ class UnscentedFilterTransform(Module):
         )
 
         self._ndim = model.hidden.num_vars + self._trans_dim + model.observable.num_vars
+        self._univariate_obs = model.observable.num_vars == 1
+        self._univariate_state = model.hidden.num_vars == 1
+
+        # ===== The dimensions are static, so resolve what the propagation needs once ===== #
+        self._hidden_prop = model.hidden.propagate_u
+        self._hidden_md = model.hidden.ndim > 0
+        self._obs_prop = model.observable.propagate_u
+        self._obs_md = model.observable.ndim > 0
 
         self._a = a
         self._b = b
         self._lam = a ** 2 * (self._ndim + k) - self._ndim
+        self._set_weights()
 
         self._hidden_views = None
         self._obs_views = None
+        self._view_cache = dict()  # type: Dict[Tuple[int, int], Tuple[Tuple[int, Tuple[int, ...]], torch.Tensor]]
+        self._sps = None
 
         self._diaginds = range(model.hidden_ndim)
 
@@ -126,117 +229,169 @@ class UnscentedFilterTransform(Module):
         self._sslc = slice(hidden_dim)
         self._hslc = slice(hidden_dim, hidden_dim + self._trans_dim)
         self._oslc = slice(hidden_dim + self._trans_dim, None)
+        self._nslc = slice(hidden_dim, None)
 
         return self
 
     def _set_weights(self):
-        self._wm = torch.zeros(1 + 2 * self._ndim)
-        self._wc = self._wm.clone()
-        self._wm[0] = self._lam / (self._ndim + self._lam)
-        self._wc[0] = self._wm[0] + (1 - self._a ** 2 + self._b)
-        self._wm[1:] = self._wc[1:] = 1 / 2 / (self._ndim + self._lam)
+        wm = torch.zeros(1 + 2 * self._ndim)
+        wc = wm.clone()
+        wm[0] = self._lam / (self._ndim + self._lam)
+        wc[0] = wm[0] + (1 - self._a ** 2 + self._b)
+        wm[1:] = wc[1:] = 1 / 2 / (self._ndim + self._lam)
+
+        # ===== Derived from the constructor arguments, so they follow the device but are not serialized ===== #
+        self.register_buffer("_wm", wm, persistent=False)
+        self.register_buffer("_wc", wc, persistent=False)
+        self.register_buffer("_sp_scale", torch.tensor(sqrt(self._lam + self._ndim)), persistent=False)
 
         return self
 
+    def _set_noise(self):
+        noise_var = torch.cat(
+            (
+                self._model.hidden.increment_dist().variance.expand(self._trans_dim),
+                self._model.observable.increment_dist().variance.expand(self._model.observable.num_vars),
+            )
+        )
+
+        self._noise_std = noise_var.sqrt()
+
+        return self
+
+    def _get_view(self, index: Tuple[int, int], p: torch.Tensor, view_shape: Tuple[int, ...]):
+        if not isinstance(p, ExtendedParameter):
+            self._view_cache.pop(index, None)
+            return p
+
+        # ===== Keyed on position, and on the data pointer as sampling parameters rebinds the data ===== #
+        key = (p.data_ptr(), tuple(view_shape))
+        cached = self._view_cache.get(index)
+
+        if cached is None or cached[0] != key:
+            cached = self._view_cache[index] = key, p.view(view_shape)
+
+        return cached[1]
+
+    def _get_views(self, i: int, parameters: Tuple[torch.Tensor, ...], view_shape: Tuple[int, ...]):
+        return tuple(self._get_view((i, j), p, view_shape) for j, p in enumerate(parameters))
+
     def _set_arrays(self, shape: torch.Size):
         view_shape = (shape[0], *(1 for _ in shape)) if len(shape) > 0 else shape
 
-        self._hidden_views = tuple(
-                p.view(view_shape) if isinstance(p, ExtendedParameter) else p
-                for p in self._model.hidden.functional_parameters()
-        )
-
-        self._obs_views = tuple(
-                p.view(view_shape) if isinstance(p, ExtendedParameter) else p
-                for p in self._model.observable.functional_parameters()
-        )
+        self._hidden_views = self._get_views(0, self._model.hidden.functional_parameters(), view_shape)
+        self._obs_views = self._get_views(1, self._model.observable.functional_parameters(), view_shape)
 
         return self
 
     def initialize(self, shape: ShapeLike = None):
         shape = size_getter(shape)
-        self._set_weights()._set_slices()._set_arrays(shape)
+        self._set_slices()._set_noise()._set_arrays(shape)
 
-        mean = torch.zeros((*shape, self._ndim))
-        cov = torch.zeros((*shape, self._ndim, self._ndim))
+        hidden_dim = self._model.hidden.num_vars
+        cholcov = torch.zeros((*shape, hidden_dim, hidden_dim))
 
-        s_mean = self._model.hidden.i_sample((1000, *shape)).mean(0)
+        mean = self._model.hidden.i_sample((1000, *shape)).mean(0)
         if self._model.hidden_ndim < 1:
-            s_mean.unsqueeze_(-1)
+            mean.unsqueeze_(-1)
+
+        # ===== The initial covariance is diagonal, and so is its square root ===== #
+        var = self._model.hidden.initial_dist().variance
+        cholcov.diagonal(dim1=-2, dim2=-1).copy_(var.sqrt())
 
-        mean[..., self._sslc] = s_mean
+        return UFTCorrectionResult(mean, cholcov, None, None)
 
-        var = s_cov = self._model.hidden.initial_dist().variance
-        if self._model.hidden_ndim > 0:
-            s_cov = construct_diag(var)
+    def _records_graph(self, state: UFTCorrectionResult) -> bool:
+        if not torch.is_grad_enabled():
+            return False
 
-        cov[..., self._sslc, self._sslc] = s_cov
-        cov[..., self._hslc, self._hslc] = construct_diag(self._model.hidden.increment_dist().variance)
-        cov[..., self._oslc, self._oslc] = construct_diag(self._model.observable.increment_dist().variance)
+        tensors = (state.mean, state.cholcov, *self._hidden_views, *self._obs_views)
 
-        return UFTCorrectionResult(mean, cov, self._sslc, None, None)
+        return any(t.requires_grad for t in tensors)
 
     def _get_sps(self, state: UFTCorrectionResult):
-        cholcov = sqrt(self._lam + self._ndim) * torch.cholesky(state.cov)
+        hidden_dim = state.mean.shape[-1]
+        shape = (*state.mean.shape[:-1], 1 + 2 * self._ndim, self._ndim)
+
+        # ===== Sigma points are only valid until the next call, so reuse the memory unless recording a graph ===== #
+        if self._records_graph(state):
+            sps = state.mean.new_empty(shape)
+        else:
+            sps = self._sps
+            if sps is None or sps.shape != shape or sps.device != state.mean.device or sps.dtype != state.mean.dtype:
+                sps = self._sps = state.mean.new_empty(shape)
 
-        spx = state.mean.unsqueeze(-2)
-        sph = state.mean[..., None, :] + cholcov
-        spy = state.mean[..., None, :] - cholcov
+        # ===== The sigma points are given by the columns of the Cholesky factor ===== #
+        cholcov = self._sp_scale * state.cholcov.transpose(-1, -2)
+        noise = self._sp_scale * self._noise_std
 
-        return torch.cat((spx, sph, spy), -2)
+        sps[..., self._sslc] = state.mean.unsqueeze(-2)
+        sps[..., self._nslc] = 0.0
+
+        # ===== The noise is independent of the state, and so the augmented Cholesky factor is block diagonal ===== #
+        sps[..., 1 : hidden_dim + 1, self._sslc] += cholcov
+        sps[..., hidden_dim + 1 : self._ndim + 1, self._nslc].diagonal(dim1=-2, dim2=-1).copy_(noise)
+        sps[..., self._ndim + 1 : self._ndim + hidden_dim + 1, self._sslc] -= cholcov
+        sps[..., self._ndim + hidden_dim + 1 :, self._nslc].diagonal(dim1=-2, dim2=-1).copy_(-noise)
+
+        return sps
 
     def predict(self, utf_corr: UFTCorrectionResult):
         sps = self._get_sps(utf_corr)
 
-        spx = _propagate_sps(sps[..., self._sslc], sps[..., self._hslc], self._model.hidden, self._hidden_views)
-        spy = _propagate_sps(spx, sps[..., self._oslc], self._model.observable, self._obs_views)
+        spx = _propagate_sps(
+            sps[..., self._sslc], sps[..., self._hslc], self._hidden_prop, self._hidden_md, self._hidden_views
+        )
+        spy = _propagate_sps(spx, sps[..., self._oslc], self._obs_prop, self._obs_md, self._obs_views)
 
         return UFTPredictionResult(spx, spy)
 
-    def calc_mean_cov(self, uft_pred: UFTPredictionResult):
-        xmean, xcov = _get_meancov(uft_pred.spx, self._wm, self._wc)
-        ymean, ycov = _get_meancov(uft_pred.spy, self._wm, self._wc)
+    def _aggregate(self, uft_pred: UFTPredictionResult):
+        xmean, tx, xchol = _get_meancov(uft_pred.spx, self._wm, self._wc)
+        ymean, ty, ychol = _get_meancov(uft_pred.spy, self._wm, self._wc)
 
-        return AggregatedResult(xmean, xcov, ymean, ycov)
+        return AggregatedResult(xmean, xchol, ymean, ychol), tx, ty
+
+    def calc_mean_cov(self, uft_pred: UFTPredictionResult):
+        return self._aggregate(uft_pred)[0]
 
     def update_state(
         self,
         xm: torch.Tensor,
-        xc: torch.Tensor,
+        xl: torch.Tensor,
         state: UFTCorrectionResult,
         ym: torch.Tensor = None,
-        yc: torch.Tensor = None,
+        yl: torch.Tensor = None,
     ):
-        # ===== Overwrite ===== #
-        mean = state.mean.clone()
-        cov = state.cov.clone()
-
-        mean[..., self._sslc] = xm
-        cov[..., self._sslc, self._sslc] = xc
-
-        return UFTCorrectionResult(mean, cov, self._sslc, ym, yc)
+        return UFTCorrectionResult(xm, xl, ym, yl)
 
     def correct(self, y: torch.Tensor, uft_pred: UFTPredictionResult, prev_corr: UFTCorrectionResult):
-        correction = self.calc_mean_cov(uft_pred)
-        xmean, xcov, ymean, ycov = correction.xm, correction.xc, correction.ym, correction.yc
+        # ===== Reuse the centered sigma points of the moments rather than centering them anew ===== #
+        correction, tx, ty = self._aggregate(uft_pred)
+        xmean, xchol, ymean, ychol = correction.xm, correction.xl, correction.ym, correction.yl
 
-        if xmean.dim() > 1:
-            tx = uft_pred.spx - xmean.unsqueeze(-2)
-        else:
-            tx = uft_pred.spx - xmean
+        xycov = _covariance(tx, ty, self._wc)
 
-        if ymean.dim() > 1:
-            ty = uft_pred.spy - ymean.unsqueeze(-2)
+        # ===== Solve for the gain K = Pxy * (S_y * S_y^t)^-1 via two triangular solves, or divisions if scalar ===== #
+        if self._univariate_obs:
+            temp = xycov.transpose(-1, -2) / ychol
+            gain = (temp / ychol).transpose(-1, -2)
         else:
-            ty = uft_pred.spy - ymean
+            temp = torch.linalg.solve_triangular(ychol, xycov.transpose(-1, -2), upper=False)
+            gain = torch.linalg.solve_triangular(ychol.transpose(-1, -2), temp, upper=True).transpose(-1, -2)
 
-        xycov = _covariance(tx, ty, self._wc)
+        txmean = xmean + torch.matmul(gain, (y - ymean).unsqueeze(-1))[..., 0]
 
-        gain = torch.matmul(xycov, ycov.inverse())
+        # ===== Downdate with the columns of K * S_y = (S_y^-1 * Pxy^t)^t, as K * Pyy * K^t = (K S_y)(K S_y)^t ===== #
+        u = temp.transpose(-1, -2)
 
-        txmean = xmean + torch.matmul(gain, (y - ymean).unsqueeze(-1))[..., 0]
+        if self._univariate_state:
+            txchol = _check_cholesky((xchol ** 2 - (u ** 2).sum(-1, keepdim=True)).sqrt())
+        else:
+            downdate = u.new_full((), -1.0)
 
-        temp = torch.matmul(ycov, gain.transpose(-1, -2))
-        txcov = xcov - torch.matmul(gain, temp)
+            txchol = xchol
+            for i in range(u.shape[-1]):
+                txchol = _cholupdate(txchol, u[..., i], downdate)
 
-        return self.update_state(txmean, txcov, prev_corr, ymean, ycov)
+        return self.update_state(txmean, txchol, prev_corr, ymean, ychol)
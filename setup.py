@@ -24,7 +24,7 @@ setup(
     packages=find_packages(),
     install_requires=[
         "scipy>=0.18.1",
-        "torch>1.5.0",
+        "torch>=1.11.0",
         "tqdm>=4.26",
         "numpy"
     ]
@@ -1,6 +1,7 @@
 import unittest
 from torch.distributions import Normal, Exponential, Independent, LogNormal
 import torch
+import numpy as np
 from scipy.stats import gaussian_kde
 from pyfilter.filters import UKF, APF
 from pyfilter.distributions import Prior
@@ -10,6 +11,7 @@ from pyfilter.distributions import DistributionWrapper
 from pyfilter.inference.sequential import NESSMC2, NESS, SMC2FW, SMC2
 from pyfilter.inference.batch.variational import approximation as apx, VariationalBayes
 from pyfilter.inference.batch.mcmc import PMMH
+from pyfilter.inference.utils import _to_tensor
 
 
 def f(x, alpha, sigma):
@@ -124,6 +126,27 @@ class InferenceAlgorithmTests(unittest.TestCase):
 
         # TODO: Add check for posterior
 
+    def test_ToTensor(self):
+        class Frame:
+            def __init__(self, values):
+                self._values = values
+
+            def to_numpy(self):
+                return self._values
+
+        values = [[1.0, 2.0], [3.0, 4.0]]
+
+        for data in [values, np.array(values, dtype=np.float64), Frame(np.array(values))]:
+            as_tensor = _to_tensor(data)
+
+            assert as_tensor.dtype == torch.get_default_dtype() and (as_tensor == torch.tensor(values)).all()
+
+        tensor = torch.tensor(values, dtype=torch.float64)
+        assert _to_tensor(tensor).dtype == torch.float64
+
+        with self.assertRaises(ValueError):
+            _to_tensor("not data")
+
 
 if __name__ == "__main__":
     unittest.main()
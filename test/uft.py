@@ -1,10 +1,10 @@
 import unittest
 from pyfilter.timeseries import AffineProcess, AffineObservations, StateSpaceModel
-from torch.distributions import Normal, MultivariateNormal
-from pyfilter.uft import UnscentedFilterTransform
+from torch.distributions import Normal, MultivariateNormal, LogNormal
+from pyfilter.uft import UnscentedFilterTransform, _covariance, _sqrt_covariance, _cholupdate
 import torch
 from pyfilter.utils import concater
-from pyfilter.distributions import DistributionWrapper
+from pyfilter.distributions import DistributionWrapper, Prior
 
 
 def f(x, alpha, sigma):
@@ -91,3 +91,141 @@ class Tests(unittest.TestCase):
         c = uft.correct(torch.tensor(0.0), p, res)
 
         assert isinstance(c.x_dist(), MultivariateNormal) and c.x_dist().mean.shape == torch.Size([3000, 2])
+
+    def test_UnscentedTransformBackward(self):
+        alpha = torch.nn.Parameter(torch.tensor(0.9))
+
+        norm = DistributionWrapper(Normal, loc=0.0, scale=1.0)
+        linear = AffineProcess((f, g), (alpha, 1.0), norm, norm)
+        linearobs = AffineObservations((fo, go), (1.0, 1.0), norm)
+        model = StateSpaceModel(linear, linearobs)
+
+        x, y = model.sample_path(5)
+        y = y.detach()
+
+        uft = UnscentedFilterTransform(model)
+        c = uft.initialize()
+
+        loglikelihood = 0.0
+        for yt in y:
+            c = uft.correct(yt, uft.predict(c), c)
+            loglikelihood += c.y_dist().log_prob(yt)
+
+        loglikelihood.backward()
+
+        assert alpha.grad is not None and torch.isfinite(alpha.grad)
+
+    def test_SquareRootCovariance(self):
+        ndim = 3
+        wc = torch.empty(2 * ndim + 1).fill_(1 / 2 / ndim)
+        wc[0] = 2.0
+
+        centered = torch.randn((300, 2 * ndim + 1, ndim))
+
+        chol = _sqrt_covariance(centered, wc)
+        cov = _covariance(centered, centered, wc)
+
+        assert torch.allclose(torch.matmul(chol, chol.transpose(-1, -2)), cov, atol=1e-5)
+
+    def test_SquareRootCovarianceNegativeWeight(self):
+        ndim = 3
+        wc = torch.empty(2 * ndim + 1).fill_(1 / 2 / ndim)
+        wc[0] = -0.5
+
+        generator = torch.Generator().manual_seed(123)
+        centered = torch.randn((300, 2 * ndim + 1, ndim), generator=generator)
+        centered[..., 0, :] *= 0.1
+
+        # ===== A negative central weight may yield an indefinite matrix, so only keep the well conditioned ===== #
+        cov = _covariance(centered, centered, wc)
+        is_pd = torch.linalg.eigvalsh(cov)[..., 0] > 1e-2
+
+        assert is_pd.sum() > 100
+
+        chol = _sqrt_covariance(centered[is_pd], wc)
+
+        assert torch.allclose(torch.matmul(chol, chol.transpose(-1, -2)), cov[is_pd], atol=1e-5)
+
+    def test_CholeskyDowndate(self):
+        ndim = 3
+        a = torch.randn((300, ndim, ndim))
+        cov = torch.matmul(a, a.transpose(-1, -2)) + torch.eye(ndim)
+
+        chol = torch.linalg.cholesky(cov)
+
+        # ===== Keep x^t * cov^-1 * x < 1, so that the downdated matrix is positive definite ===== #
+        z = torch.randn((300, ndim))
+        x = torch.matmul(chol, (0.5 * z / z.norm(dim=-1, keepdim=True)).unsqueeze(-1))[..., 0]
+
+        downdated = _cholupdate(chol, x, torch.tensor(-1.0))
+        expected = torch.linalg.cholesky(cov - x.unsqueeze(-1) * x.unsqueeze(-2))
+
+        assert torch.allclose(downdated, expected, atol=1e-4)
+
+    def test_CholeskyDowndateIndefinite(self):
+        chol = torch.eye(2).expand(10, 2, 2)
+        x = 2.0 * torch.ones((10, 2))
+
+        with self.assertRaises(Exception):
+            _cholupdate(chol, x, torch.tensor(-1.0))
+
+    def test_CholeskyDowndateBackward(self):
+        ndim = 3
+        a = torch.randn((300, ndim, ndim))
+        cov = torch.matmul(a, a.transpose(-1, -2)) + torch.eye(ndim)
+
+        chol = torch.linalg.cholesky(cov).requires_grad_(True)
+        x = (0.1 * torch.randn((300, ndim))).requires_grad_(True)
+
+        _cholupdate(chol, x, torch.tensor(-1.0)).sum().backward()
+
+        assert torch.isfinite(chol.grad).all() and torch.isfinite(x.grad).all()
+
+    def test_CorrectFullCovariance(self):
+        mat = torch.eye(2)
+        scale = torch.diag(mat)
+
+        norm = DistributionWrapper(Normal, loc=0.0, scale=1.0)
+        mvn = DistributionWrapper(MultivariateNormal, loc=torch.zeros(2), covariance_matrix=torch.eye(2))
+
+        mvnlinear = AffineProcess((fmvn, g), (mat, scale), mvn, mvn)
+        mvnoblinear = AffineObservations((fomvn, gomvn), (1.0,), norm)
+
+        mvnmodel = StateSpaceModel(mvnlinear, mvnoblinear)
+
+        # ===== Start from a full covariance, such that the factor is not diagonal ===== #
+        uft = UnscentedFilterTransform(mvnmodel)
+        res = uft.initialize(300)
+        res.cholcov = torch.tensor([[1.0, 0.0], [0.5, 0.8]]).expand(300, 2, 2).clone()
+
+        p = uft.predict(res)
+        c = uft.correct(torch.tensor(0.5), p, res)
+
+        # ===== Compare with the dense update P - K * Pyy * K^t ===== #
+        agg, tx, ty = uft._aggregate(p)
+        xycov = _covariance(tx, ty, uft._wc)
+        gain = torch.matmul(xycov, agg.yc.inverse())
+
+        expected = agg.xc - torch.matmul(torch.matmul(gain, agg.yc), gain.transpose(-1, -2))
+
+        assert torch.allclose(c.cov, expected, atol=1e-5)
+
+    def test_ParameterViewsFollowSampling(self):
+        norm = DistributionWrapper(Normal, loc=0.0, scale=1.0)
+        priors = Prior(Normal, loc=0.0, scale=1.0), Prior(LogNormal, loc=0.0, scale=1.0)
+
+        linear = AffineProcess((f, g), priors, norm, norm)
+        linearobs = AffineObservations((fo, go), (1.0, 1.0), norm)
+        model = StateSpaceModel(linear, linearobs)
+
+        uft = UnscentedFilterTransform(model)
+
+        for shape in [(300,), (300,), (500,)]:
+            model.sample_params(shape)
+            uft.initialize(shape)
+
+            for view, p in zip(uft._hidden_views, model.hidden.functional_parameters()):
+                assert view.shape == torch.Size([shape[0], 1]) and (view[:, 0] == p).all()
+
+            pred = uft.predict(uft.initialize(shape))
+            assert pred.spx.shape[0] == shape[0]